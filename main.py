@@ -1,13 +1,34 @@
 # main.py
 import os
+import hashlib
+import secrets
+import sqlite3
 import asyncio
 import zipfile
 import shutil
+import tempfile
+import threading
+from contextlib import ExitStack
+from collections import OrderedDict
 from pathlib import Path
 from urllib.parse import urlparse
 import logging
-
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from functools import lru_cache
+from typing import Literal
+
+from telegram import (
+    Update,
+    Message,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InputFile,
+    InputMediaAudio,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo,
+)
+from telegram.error import BadRequest, TelegramError
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -17,9 +38,11 @@ from telegram.ext import (
     ContextTypes,
 )
 
+import aiofiles
+import aiohttp
 import yt_dlp
 from spotdl import Spotdl
-import requests
+from spotdl.download.downloader import Downloader
 from bs4 import BeautifulSoup
 
 # ────────────────────────────────────────
@@ -33,9 +56,39 @@ if not BOT_TOKEN:
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 
+# Optional: self-hosted Bot API server (e.g. http://localhost:8081) on the same
+# filesystem — uploads are then sent as local paths the server reads from disk,
+# and the 50 MB limit rises to 2000 MB. Without it, uploads are streamed from
+# open file handles (see upload_input).
+BOT_API_URL = os.getenv("BOT_API_URL", "").rstrip("/")
+
+# Caps concurrent yt-dlp/FFmpeg work per Spotify job
+SPOTIFY_PARALLEL_DOWNLOADS = 6
+
+# Caps download jobs across all chats (Spotify, Pinterest and YouTube together)
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "8"))
+
+# Telegram bot upload limit is ~50 MB, or 2000 MB through a local Bot API server
+TELEGRAM_UPLOAD_LIMIT_MB = 1990 if BOT_API_URL else 48
+
+# Minimum seconds between progress edits of a status message
+STATUS_EDIT_INTERVAL = 3
+
+# Read size for streamed downloads
+CHUNK_SIZE = 64 * 1024
+
 DOWNLOAD_DIR = Path("downloads")
 DOWNLOAD_DIR.mkdir(exist_ok=True)
 
+# Telegram file_id cache, so repeat links are re-sent without downloading
+CACHE_DB = Path(os.getenv("CACHE_DB", "cache.db"))
+db = sqlite3.connect(CACHE_DB)
+db.execute(
+    "CREATE TABLE IF NOT EXISTS media ("
+    "url TEXT NOT NULL, kind TEXT NOT NULL, file_id TEXT NOT NULL, "
+    "PRIMARY KEY (url, kind))"
+)
+
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
 )
@@ -46,137 +99,429 @@ spotdl_client = Spotdl(
     client_secret=SPOTIFY_CLIENT_SECRET or "your-spotify-client-secret"
 )
 
+# YoutubeDL per format and worker thread, built once per thread — constructing
+# it loads every extractor, and an instance isn't safe to share across threads
+YDL_OPTS = {
+    "outtmpl": "%(title)s.%(ext)s",  # relative to the job dir set per call
+    "quiet": True,
+    "no_warnings": True,
+}
+YDL_FORMAT_OPTS = {
+    "mp3": {
+        **YDL_OPTS,
+        "format": "bestaudio/best",
+        "postprocessors": [{
+            "key": "FFmpegExtractAudio",
+            "preferredcodec": "mp3",
+            "preferredquality": "192",
+        }],
+    },
+    "mp4": {
+        **YDL_OPTS,
+        "format": "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best",
+    },
+}
+ydl_local = threading.local()
+
+PINTEREST_DOMAINS = (
+    "pin.it", "pinterest.com", "pinterest.co.uk", "pinterest.ca", "pinterest.com.au",
+    "pinterest.com.mx", "pinterest.de", "pinterest.fr", "pinterest.es", "pinterest.it",
+    "pinterest.pt", "pinterest.at", "pinterest.ch", "pinterest.ie", "pinterest.nz",
+    "pinterest.se", "pinterest.dk", "pinterest.jp", "pinterest.co.kr", "pinterest.ph",
+    "pinterest.cl", "pinterest.ru",
+)
+URL_KINDS = {
+    "spotify.com": "spotify",
+    "youtube.com": "youtube",
+    "youtu.be": "youtube",
+    **{domain: "pinterest" for domain in PINTEREST_DOMAINS},
+}
+
+HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"}
+
+# Shared HTTP session, created in post_init once the event loop is running
+http_session: aiohttp.ClientSession | None = None
+
+# Excess jobs wait here instead of exhausting file descriptors, disk or RAM
+download_slots = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+
+# (chat_id, url, format) of YouTube downloads currently running
+yt_inflight: set[tuple[int, str, str]] = set()
+
+# callback_data is capped at 64 bytes, so buttons carry a short token instead
+# of the URL; the oldest tokens are evicted once the map is full
+CALLBACK_URLS_MAX = 1024
+callback_urls: OrderedDict[str, str] = OrderedDict()
+
 # ────────────────────────────────────────
 # Helpers
 # ────────────────────────────────────────
 
-def is_spotify_url(url: str) -> bool:
-    return "spotify.com" in urlparse(url).netloc
-
-def is_pinterest_url(url: str) -> bool:
-    domain = urlparse(url).netloc.lower()
-    return "pinterest." in domain or "pin.it" in domain
-
-def is_youtube_url(url: str) -> bool:
-    domain = urlparse(url).netloc.lower()
-    return "youtube.com" in domain or "youtu.be" in domain
-
-async def download_youtube(url: str, format_type: str, update: Update) -> Path | None:
-    ydl_opts = {
-        "outtmpl": str(DOWNLOAD_DIR / "%(title)s.%(ext)s"),
-        "quiet": True,
-        "no_warnings": True,
-    }
-    if format_type == "mp3":
-        ydl_opts.update({
-            "format": "bestaudio/best",
-            "postprocessors": [{
-                "key": "FFmpegExtractAudio",
-                "preferredcodec": "mp3",
-                "preferredquality": "192",
-            }],
-        })
-    else:  # mp4
-        ydl_opts["format"] = "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best"
+def make_job_dir(prefix: str) -> Path:
+    # Unique per job, so concurrent jobs for the same link never share files
+    return Path(tempfile.mkdtemp(prefix=prefix, dir=DOWNLOAD_DIR))
+
+def url_key(url: str) -> str:
+    # Stable across restarts, unlike the per-process salted hash()
+    return hashlib.blake2b(url.encode(), digest_size=8).hexdigest()
+
+def cached_media(url: str, kind: str | None = None) -> list[tuple[str, str]]:
+    if kind:
+        rows = db.execute(
+            "SELECT kind, file_id FROM media WHERE url = ? AND kind = ?", (url_key(url), kind)
+        )
+    else:
+        rows = db.execute("SELECT kind, file_id FROM media WHERE url = ?", (url_key(url),))
+    return rows.fetchall()
 
+def remember_media(url: str, kind: str, file_id: str) -> None:
+    db.execute(
+        "INSERT OR REPLACE INTO media (url, kind, file_id) VALUES (?, ?, ?)",
+        (url_key(url), kind, file_id),
+    )
+    db.commit()
+
+def forget_media(url: str) -> None:
+    db.execute("DELETE FROM media WHERE url = ?", (url_key(url),))
+    db.commit()
+
+def upload_input(stack: ExitStack, media):
+    # file_ids pass through; in local Bot API mode a bare Path is sent as a
+    # file:// URI the server reads itself. Otherwise stream from an open handle
+    # (read_file_handle=False) instead of letting PTB read the file into memory.
+    if not isinstance(media, Path) or BOT_API_URL:
+        return media
+    fh = stack.enter_context(media.open("rb"))
+    return InputFile(fh, filename=media.name, read_file_handle=False)
+
+async def reply_media(message: Message, kind: str, media, **kwargs) -> Message:
+    with ExitStack() as stack:
+        media = upload_input(stack, media)
+        if kind == "audio":
+            return await message.reply_audio(audio=media, **kwargs)
+        if kind == "video":
+            return await message.reply_video(video=media, **kwargs)
+        if kind == "document":
+            return await message.reply_document(document=media, **kwargs)
+        return await message.reply_photo(photo=media, **kwargs)
+
+INPUT_MEDIA = {
+    "audio": InputMediaAudio,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+    "photo": InputMediaPhoto,
+}
+
+async def reply_media_batch(message: Message, items: list[tuple[str, object]]) -> list[Message]:
+    # One sendMediaGroup call instead of one upload per item (groups need 2–10 items)
+    if len(items) == 1:
+        kind, media = items[0]
+        return [await reply_media(message, kind, media)]
+    with ExitStack() as stack:
+        group = [INPUT_MEDIA[kind](media=upload_input(stack, media)) for kind, media in items]
+        return list(await message.reply_media_group(media=group))
+
+def sent_file_id(msg: Message, kind: str) -> str:
+    if kind == "photo":
+        return msg.photo[-1].file_id
+    return getattr(msg, kind).file_id
+
+async def send_cached(message: Message, url: str, kind: str | None = None) -> bool:
+    cached = cached_media(url, kind)
+    if not cached:
+        return False
+    try:
+        await reply_media_batch(message, cached)
+    except BadRequest as e:
+        # file_id no longer valid on Telegram's side → fall back to a fresh download
+        logger.warning(f"Stale file_id for {url}: {e}")
+        forget_media(url)
+        return False
+    return True
+
+async def edit_status(status: Message, text: str) -> None:
+    try:
+        await status.edit_text(text)
+    except TelegramError as e:
+        # Unchanged text, message gone, flood control or a network blip —
+        # progress is cosmetic and must never fail the job
+        logger.debug(f"Status edit skipped: {e}")
+
+def callback_token(url: str) -> str:
+    token = secrets.token_urlsafe(6)
+    callback_urls[token] = url
+    if len(callback_urls) > CALLBACK_URLS_MAX:
+        callback_urls.popitem(last=False)
+    return token
+
+@lru_cache(maxsize=2048)
+def classify_url(url: str) -> Literal["spotify", "pinterest", "youtube"] | None:
+    host = urlparse(url).hostname or ""  # already lowercased, port stripped
+    # Walk the parent domains (www.pinterest.co.uk → pinterest.co.uk → co.uk)
+    labels = host.split(".")
+    for i in range(len(labels) - 1):
+        kind = URL_KINDS.get(".".join(labels[i:]))
+        if kind:
+            return kind
+    return None
+
+def run_youtube_dl(url: str, format_type: str, job_dir: Path) -> str:
+    # Runs in a worker thread; each thread keeps its own YoutubeDL instances
+    clients = getattr(ydl_local, "clients", None)
+    if clients is None:
+        clients = ydl_local.clients = {}
+    if format_type not in clients:
+        clients[format_type] = yt_dlp.YoutubeDL(YDL_FORMAT_OPTS[format_type])
+    ydl = clients[format_type]
+    ydl.params["paths"] = {"home": str(job_dir)}
+    info = ydl.extract_info(url, download=True)
+    return ydl.prepare_filename(info)
+
+async def download_youtube(url: str, format_type: str, status: Message, job_dir: Path) -> Path | None:
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = await asyncio.to_thread(ydl.extract_info, url, download=True)
-            filename = ydl.prepare_filename(info)
-            if format_type == "mp3":
-                filename = filename.rsplit(".", 1)[0] + ".mp3"
-            return Path(filename)
+        async with download_slots:
+            filename = await asyncio.to_thread(run_youtube_dl, url, format_type, job_dir)
+        if format_type == "mp3":
+            filename = filename.rsplit(".", 1)[0] + ".mp3"
+        return Path(filename)
     except Exception as e:
-        await update.message.reply_text(f"YouTube download failed: {str(e)[:200]}")
+        await edit_status(status, f"YouTube download failed: {str(e)[:200]}")
         return None
 
-def download_pinterest(url: str) -> list[Path] | None:
+async def fetch_to_file(url: str, fname: Path) -> None:
+    limit = TELEGRAM_UPLOAD_LIMIT_MB * 1024 * 1024
     try:
-        headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"}
-        r = requests.get(url, headers=headers, timeout=15)
-        soup = BeautifulSoup(r.text, "html.parser")
-        media = []
-
-        # Try to find main image
-        img_tag = soup.find("img", {"src": lambda s: s and any(x in s for x in [".jpg", ".png", "pinimg.com"])})
-        if img_tag and img_tag.get("src"):
-            img_url = img_tag["src"]
-            if not img_url.startswith("http"):
-                img_url = "https:" + img_url
-            fname = DOWNLOAD_DIR / f"pin_{hash(url)}.jpg"
-            with open(fname, "wb") as f:
-                f.write(requests.get(img_url, headers=headers).content)
-            media.append(fname)
-
-        # Try video
-        video_tag = soup.find("video", {"src": True})
-        if video_tag:
-            vid_url = video_tag["src"]
-            if not vid_url.startswith("http"):
-                vid_url = "https:" + vid_url
-            fname = DOWNLOAD_DIR / f"pin_{hash(url)}.mp4"
-            with open(fname, "wb") as f:
-                f.write(requests.get(vid_url, headers=headers).content)
-            media.append(fname)
-
-        return media if media else None
+        async with http_session.get(url, timeout=aiohttp.ClientTimeout(total=120)) as r:
+            r.raise_for_status()
+            if (r.content_length or 0) > limit:
+                raise ValueError(f"media too large ({r.content_length} bytes)")
+            written = 0
+            async with aiofiles.open(fname, "wb") as f:
+                async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                    written += len(chunk)
+                    if written > limit:
+                        raise ValueError("media too large")
+                    await f.write(chunk)
+    except Exception:
+        fname.unlink(missing_ok=True)  # never leave a truncated file behind
+        raise
+
+async def download_pinterest(url: str, job_dir: Path) -> list[Path] | None:
+    media = []
+    try:
+        async with download_slots:
+            async with http_session.get(url, timeout=aiohttp.ClientTimeout(total=15)) as r:
+                html = await r.text()
+            soup = BeautifulSoup(html, "lxml")
+
+            # Try to find main image
+            img_tag = soup.select_one('img[src*="pinimg.com"], img[src*=".jpg"], img[src*=".png"]')
+            if img_tag:
+                img_url = img_tag["src"]
+                if not img_url.startswith("http"):
+                    img_url = "https:" + img_url
+                fname = job_dir / "pin.jpg"
+                await fetch_to_file(img_url, fname)
+                media.append(fname)
+
+            # Try video
+            video_tag = soup.select_one("video[src]")
+            if video_tag:
+                vid_url = video_tag["src"]
+                if not vid_url.startswith("http"):
+                    vid_url = "https:" + vid_url
+                fname = job_dir / "pin.mp4"
+                await fetch_to_file(vid_url, fname)
+                media.append(fname)
+
+            return media if media else None
     except Exception as e:
         logger.error(f"Pinterest error: {e}")
+        # The image may be saved before the video fetch fails — drop it too
+        await asyncio.gather(*(asyncio.to_thread(f.unlink, missing_ok=True) for f in media))
         return None
 
-async def process_spotify(url: str, update: Update) -> None:
-    chat_id = update.effective_chat.id
-    try:
-        songs = spotdl_client.search([url])
-        if not songs:
-            await update.message.reply_text("No tracks found on Spotify.")
-            return
-
-        name = songs[0].artist if len(songs) == 1 else "Playlist"
-        await update.message.reply_text(f"Found {len(songs)} track(s). Downloading...")
+async def download_songs(songs: list, temp_dir: Path, status: Message) -> list[Path | None]:
+    if not songs:
+        return []
 
-        temp_dir = DOWNLOAD_DIR / f"temp_{hash(url)}"
-        temp_dir.mkdir(exist_ok=True)
-        zip_path = DOWNLOAD_DIR / f"{name.replace(' ', '_')}.zip"
-
-        for song in songs:
+    # A Downloader per job writes straight into temp_dir, so no move afterwards.
+    # It drives its own event loop inside download_song, so concurrent calls
+    # would collide; search_and_download is the per-song worker it runs on its
+    # own thread pool.
+    downloader = await asyncio.to_thread(
+        Downloader, {"output": str(temp_dir / "{artists} - {title}.{output-ext}")}
+    )
+    sem = asyncio.Semaphore(SPOTIFY_PARALLEL_DOWNLOADS)
+    loop = asyncio.get_running_loop()
+    done = 0
+    last_edit = loop.time()
+
+    async def download_one(song):
+        nonlocal done, last_edit
+        async with sem:
             try:
-                result = await asyncio.to_thread(spotdl_client.download_song, song)
-                if result and result[0]:
-                    song_file = Path(result[0])
-                    if song_file.exists():
-                        song_file.rename(temp_dir / song_file.name)
-            except:
-                pass  # skip failed songs
-
-        if not any(temp_dir.iterdir()):
-            await update.message.reply_text("Download failed — no files saved.")
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            return
+                result = await asyncio.to_thread(downloader.search_and_download, song)
+            except Exception as e:
+                result = e
 
-        # Create ZIP
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
-            for file in temp_dir.rglob("*"):
-                zf.write(file, file.relative_to(temp_dir))
+        done += 1
+        # Throttled so a big playlist doesn't turn into one edit per song
+        if loop.time() - last_edit >= STATUS_EDIT_INTERVAL and done < len(songs):
+            last_edit = loop.time()
+            await edit_status(status, f"Downloading {done}/{len(songs)}…")
+        return result
 
+    try:
+        results = await asyncio.gather(*(download_one(s) for s in songs), return_exceptions=True)
+    finally:
+        # The Downloader creates its own event loop; release its selector FDs now
+        await asyncio.to_thread(downloader.loop.close)
+    paths = []
+    for song, result in zip(songs, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Spotify song failed ({song.display_name}): {result}")
+            paths.append(None)
+            continue
+        _, song_path = result
+        paths.append(Path(song_path) if song_path else None)
+    return paths
+
+async def send_spotify_audio(
+    message: Message,
+    status: Message,
+    temp_dir: Path,
+    songs: list,
+    cached: dict[str, str],
+    downloaded: dict[str, Path],
+) -> None:
+    tracks = []
+    for song in songs:
+        if song.url in cached:
+            tracks.append((song, cached[song.url]))
+        elif song.url in downloaded:
+            tracks.append((song, downloaded[song.url]))
+
+    # Telegram albums hold at most 10 items
+    for i in range(0, len(tracks), 10):
+        batch = tracks[i:i + 10]
+        try:
+            sent = await reply_media_batch(message, [("audio", media) for _, media in batch])
+        except BadRequest as e:
+            # A cached file_id went stale on Telegram's side → forget and re-download those
+            stale = [song for song, media in batch if not isinstance(media, Path)]
+            if not stale:
+                raise
+            logger.warning(f"Stale Spotify file_ids ({len(stale)}): {e}")
+            for song in stale:
+                forget_media(song.url)
+            paths = await download_songs(stale, temp_dir, status)
+            fresh = {song.url: path for song, path in zip(stale, paths) if path}
+            batch = [
+                (song, media if isinstance(media, Path) else fresh[song.url])
+                for song, media in batch
+                if isinstance(media, Path) or song.url in fresh
+            ]
+            if not batch:
+                continue
+            sent = await reply_media_batch(message, [("audio", media) for _, media in batch])
+        for (song, media), msg in zip(batch, sent):
+            if isinstance(media, Path):
+                remember_media(song.url, "audio", sent_file_id(msg, "audio"))
+
+def write_zip(zip_path: Path, files: list[Path]) -> None:
+    # MP3s are already compressed, so store them as-is
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for file in files:
+            zf.write(file, file.name)
+
+async def send_spotify_zip(
+    message: Message, status: Message, temp_dir: Path, cache_key: str | None, name: str, files: list[Path]
+) -> bool:
+    zip_path = temp_dir / f"{name.replace(' ', '_')}.zip"
+
+    await asyncio.to_thread(write_zip, zip_path, files)
+
+    try:
         file_size_mb = zip_path.stat().st_size / (1024 * 1024)
-        if file_size_mb < 48:  # Telegram bot limit ~50 MB
-            await update.message.reply_document(
-                document=zip_path,
-                caption=f"Spotify download: {name} ({len(songs)} tracks)"
+        fits = file_size_mb < TELEGRAM_UPLOAD_LIMIT_MB
+        if fits:
+            msg = await reply_media(
+                message,
+                "document",
+                zip_path,
+                caption=f"Spotify download: {name} ({len(files)} tracks)",
             )
+            if cache_key:
+                remember_media(cache_key, "document", sent_file_id(msg, "document"))
         else:
-            await update.message.reply_text(
-                f"ZIP is too big ({file_size_mb:.1f} MB). Telegram limit is ~50 MB.\n"
-                "Try a smaller playlist or ask for individual songs."
+            await edit_status(
+                status,
+                f"ZIP is too big ({file_size_mb:.1f} MB). Telegram limit is ~{TELEGRAM_UPLOAD_LIMIT_MB} MB.\n"
+                "Send the link without /zip to get the songs as audio messages."
             )
+    finally:
+        await asyncio.to_thread(zip_path.unlink, missing_ok=True)
+    return fits
 
-        # Cleanup
-        shutil.rmtree(temp_dir, ignore_errors=True)
-        zip_path.unlink(missing_ok=True)
+async def process_spotify(url: str, update: Update, status: Message, as_zip: bool = False) -> None:
+    try:
+        async with download_slots:
+            songs = await asyncio.to_thread(spotdl_client.search, [url])
+            if not songs:
+                await edit_status(status, "No tracks found on Spotify.")
+                return
+
+            name = songs[0].artist if len(songs) == 1 else "Playlist"
+
+            # A ZIP is cached under its exact track list, so an edited playlist
+            # gets a fresh archive instead of an old snapshot
+            zip_key = "zip:" + "\n".join(sorted(song.url for song in songs))
+            if as_zip and await send_cached(update.message, zip_key, "document"):
+                await status.delete()
+                return
+
+            # Songs sent before are re-sent by file_id; a ZIP needs every file on disk
+            cached = {}
+            if not as_zip:
+                for song in songs:
+                    rows = cached_media(song.url, "audio")
+                    if rows:
+                        cached[song.url] = rows[0][1]
+            pending = [s for s in songs if s.url not in cached]
+
+            await edit_status(status, f"Found {len(songs)} track(s). Downloading...")
+
+            temp_dir = make_job_dir("spotify_")
+            try:
+                paths = await download_songs(pending, temp_dir, status)
+                downloaded = {song.url: path for song, path in zip(pending, paths) if path}
+
+                delivered = False
+                if not cached and not downloaded:
+                    await edit_status(status, "Download failed — no files saved.")
+                elif as_zip:
+                    # Only a complete archive is worth serving again
+                    complete = len(downloaded) == len(songs)
+                    delivered = await send_spotify_zip(
+                        update.message,
+                        status,
+                        temp_dir,
+                        zip_key if complete else None,
+                        name,
+                        list(downloaded.values()),
+                    )
+                else:
+                    await send_spotify_audio(update.message, status, temp_dir, songs, cached, downloaded)
+                    delivered = True
+            finally:
+                await asyncio.to_thread(shutil.rmtree, temp_dir, ignore_errors=True)
+
+            if delivered:
+                await status.delete()
 
     except Exception as e:
-        await update.message.reply_text(f"Spotify error: {str(e)[:300]}")
+        await edit_status(status, f"Spotify error: {str(e)[:300]}")
 
 # ────────────────────────────────────────
 # Handlers
@@ -185,41 +530,57 @@ async def process_spotify(url: str, update: Update) -> None:
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "Send me a link:\n"
-        "• Spotify playlist/album/track → ZIP of songs\n"
+        "• Spotify playlist/album/track → songs as audio\n"
         "• Pinterest pin → image or video\n"
-        "• YouTube link → choose MP3 or MP4"
+        "• YouTube link → choose MP3 or MP4\n\n"
+        "/zip <Spotify link> → all songs in one ZIP"
     )
 
+async def zip_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    url = context.args[0] if context.args else ""
+    if classify_url(url) != "spotify":
+        await update.message.reply_text("Usage: /zip <Spotify playlist/album/track link>")
+        return
+
+    status = await update.message.reply_text("Spotify detected → building ZIP...", disable_notification=True)
+    asyncio.create_task(process_spotify(url, update, status, as_zip=True))
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip()
     if not text.startswith(("http://", "https://")):
         return
 
     url = text
+    kind = classify_url(url)
 
-    if is_spotify_url(url):
-        await update.message.reply_text("Spotify detected → starting download...")
-        asyncio.create_task(process_spotify(url, update))
-
-    elif is_pinterest_url(url):
-        await update.message.reply_text("Pinterest detected → fetching media...")
-        files = download_pinterest(url)
-        if files:
-            for f in files:
-                if f.suffix.lower() == ".mp4":
-                    await update.message.reply_video(video=f.open("rb"))
-                else:
-                    await update.message.reply_photo(photo=f.open("rb"))
-            for f in files:
-                f.unlink(missing_ok=True)
-        else:
-            await update.message.reply_text("Could not download Pinterest media (page changed?).")
+    if kind == "spotify":
+        status = await update.message.reply_text("Spotify detected → starting download...", disable_notification=True)
+        asyncio.create_task(process_spotify(url, update, status))
 
-    elif is_youtube_url(url):
+    elif kind == "pinterest":
+        if await send_cached(update.message, url):
+            return
+        status = await update.message.reply_text("Pinterest detected → fetching media...", disable_notification=True)
+        job_dir = make_job_dir("pin_")
+        try:
+            files = await download_pinterest(url, job_dir)
+            if files:
+                items = [("video" if f.suffix.lower() == ".mp4" else "photo", f) for f in files]
+                sent = await reply_media_batch(update.message, items)
+                for (media_kind, _), msg in zip(items, sent):
+                    remember_media(url, media_kind, sent_file_id(msg, media_kind))
+                await status.delete()
+            else:
+                await edit_status(status, "Could not download Pinterest media (page changed?).")
+        finally:
+            await asyncio.to_thread(shutil.rmtree, job_dir, ignore_errors=True)
+
+    elif kind == "youtube":
+        token = callback_token(url)
         keyboard = [
             [
-                InlineKeyboardButton("🎵 MP3 (audio)", callback_data=f"yt|mp3|{url}"),
-                InlineKeyboardButton("🎥 MP4 (video)", callback_data=f"yt|mp4|{url}"),
+                InlineKeyboardButton("🎵 MP3 (audio)", callback_data=f"yt|mp3|{token}"),
+                InlineKeyboardButton("🎥 MP4 (video)", callback_data=f"yt|mp4|{token}"),
             ]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -230,36 +591,101 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
 
     data = query.data
     if not data.startswith("yt|"):
+        await query.answer()
+        return
+
+    _, fmt, token = data.split("|", 2)
+    url = callback_urls.get(token)
+    if url is None:
+        await query.answer("This link has expired — send it again.")
+        return
+
+    key = (query.message.chat_id, url, fmt)
+    if key in yt_inflight:
+        # Repeat tap while the first download is still running — it will deliver
+        await query.answer("Already downloading…")
         return
+    # Claim the key before the first await so a concurrent tap sees it
+    yt_inflight.add(key)
+    try:
+        await query.answer()
+        media_kind = "audio" if fmt == "mp3" else "video"
+        if await send_cached(query.message, url, media_kind):
+            await query.message.delete()
+            return
 
-    _, fmt, url = data.split("|", 2)
-    await query.edit_message_text(f"Downloading as {fmt.upper()}...")
+        await query.edit_message_text(f"Downloading as {fmt.upper()}...")
 
-    file_path = await download_youtube(url, fmt, update)
-    if file_path:
+        job_dir = make_job_dir("yt_")
         try:
-            if fmt == "mp3":
-                await query.message.reply_audio(audio=file_path.open("rb"))
-            else:
-                await query.message.reply_video(video=file_path.open("rb"))
+            file_path = await download_youtube(url, fmt, query.message, job_dir)
+            if not file_path:
+                return  # the error replaced the keyboard message
+            msg = await reply_media(query.message, media_kind, file_path)
+            remember_media(url, media_kind, sent_file_id(msg, media_kind))
         finally:
-            file_path.unlink(missing_ok=True)
+            await asyncio.to_thread(shutil.rmtree, job_dir, ignore_errors=True)
+
+        await query.message.delete()
+    finally:
+        yt_inflight.discard(key)
+        # The keyboard is gone (delivered) or replaced by an error either way
+        callback_urls.pop(token, None)
+
+async def post_init(app: Application) -> None:
+    global http_session
+    # Keep-alive pool so the pin page, image and video share warm TLS connections
+    http_session = aiohttp.ClientSession(
+        headers=HEADERS,
+        connector=aiohttp.TCPConnector(
+            limit=32, limit_per_host=16, ttl_dns_cache=300, keepalive_timeout=60
+        ),
+    )
 
-    await query.message.delete()
+async def post_shutdown(app: Application) -> None:
+    if http_session:
+        await http_session.close()
 
 def main():
-    app = Application.builder().token(BOT_TOKEN).build()
+    # Concurrent uploads from several chats shouldn't queue behind one connection
+    request = HTTPXRequest(
+        connection_pool_size=64,
+        read_timeout=300,
+        write_timeout=300,
+        media_write_timeout=300,  # multipart uploads use this, not write_timeout
+        pool_timeout=30,
+        http_version="2",
+    )
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(request)
+        # Handlers may wait on download_slots; don't let that stall other chats
+        .concurrent_updates(True)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if BOT_API_URL:
+        # local_mode makes PTB pass file:// paths instead of uploading the bytes;
+        # upload_input keeps bare Paths for exactly this case
+        builder = (
+            builder
+            .base_url(f"{BOT_API_URL}/bot")
+            .base_file_url(f"{BOT_API_URL}/file/bot")
+            .local_mode(True)
+        )
+    app = builder.build()
 
     app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("zip", zip_command))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     app.add_handler(CallbackQueryHandler(button_callback))
 
     print("Bot is starting...")
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    app.run_polling(allowed_updates=[Update.MESSAGE, Update.CALLBACK_QUERY])
 
 if __name__ == "__main__":
     main()